@@ -2,9 +2,38 @@
 
 import os
 import argparse
+import atexit
+import contextlib
+import re
+import shlex
+import shutil
+import functools
+import hashlib
+import json
+import math
 import subprocess
 import tempfile
 import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional: only needed for --in-process mastering
+try:
+    import numpy as np
+    import pyloudnorm
+    import soundfile
+    from scipy.ndimage import minimum_filter1d, uniform_filter1d
+    from scipy.signal import resample_poly
+except ImportError:
+    np = None
+
+# Optional: only needed for --progress
+try:
+    from rich.progress import Progress
+except ImportError:
+    Progress = None
 
 # Loudness profile
 PROFILE = {"LUFS": -16.3, "TP": -2.6, "LRA": 5}
@@ -14,29 +43,360 @@ DEFAULT_HEAD = os.path.expanduser("~/audio-vault-assets/avo_head.mp3")
 DEFAULT_TAIL = os.path.expanduser("~/audio-vault-assets/avo_tail.mp3")
 SILENCE_PATH = os.path.expanduser("~/audio-vault-assets/silence_1s.mp3")
 
+# Batch inputs; a tuple so str.endswith checks them all in one call
+SUPPORTED_EXTS = (".wav", ".mp3")
+
+# Optional lossless masters of the default bumpers, preferred over the MP3s when mastering
+DEFAULT_HEAD_SRC = os.path.expanduser("~/audio-vault-assets/avo_head.flac")
+DEFAULT_TAIL_SRC = os.path.expanduser("~/audio-vault-assets/avo_tail.flac")
+LOSSLESS_ASSETS = {DEFAULT_HEAD: DEFAULT_HEAD_SRC, DEFAULT_TAIL: DEFAULT_TAIL_SRC}
+
+USER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "audiovault")
+# Stereo CBR copies of the assets, reused across files and runs. Kept per user: they are
+# stream-copied into every delivered file, so nobody else may be able to plant them.
+CACHE_DIR = os.path.join(USER_CACHE_DIR, "assets")
+# Loudness measurements survive reboots; the least recently used are dropped past the limit
+LOUDNORM_CACHE_DIR = os.path.join(USER_CACHE_DIR, "loudnorm")
+LOUDNORM_CACHE_MAX = 5000
+# ffprobe results keyed by path, size and mtime, loaded on first use and saved at exit
+PROBE_CACHE_PATH = os.path.join(USER_CACHE_DIR, "probe.json")
+PROBE_CACHE_MAX = 20000
+_ASSET_LOCK = threading.Lock()
+
+# Sidecar next to each output recording what it was built from
+CACHEKEY_SUFFIX = ".cachekey"
+
+# Resolved once so each spawn skips the PATH search
+FFMPEG_BIN = shutil.which("ffmpeg") or "ffmpeg"
+FFPROBE_BIN = shutil.which("ffprobe") or "ffprobe"
+
+def usable_cpus():
+    """CPUs this process may run on, which taskset or a container can limit below the machine's total."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Batch concurrency: mastering is CPU-bound, bumper-only runs are "-c copy" and I/O-bound
+CPU_COUNT = usable_cpus()
+ENCODE_JOBS = max(1, CPU_COUNT // 4)
+COPY_JOBS = min(16, CPU_COUNT * 2)
+# Threads per ffmpeg process ("0" lets ffmpeg decide); run_batch divides the CPUs between workers
+FFMPEG_THREADS = "0"
+
+# Mastering chain for the main content
+COMPRESSOR_FILTER = "acompressor=threshold=-18dB:ratio=3:attack=10:release=200"
+LOUDNORM_TARGET = f"I={PROFILE['LUFS']}:LRA={PROFILE['LRA']}:TP={PROFILE['TP']}"
+MASTER_FILTER = f"{COMPRESSOR_FILTER},loudnorm={LOUDNORM_TARGET}"
+# Analysis pass: loudnorm stats for the input as-is and after the compressor, in one decode
+MEASURE_GRAPH = (f"[0:a]asplit=2[raw][comp];"
+                 f"[raw]loudnorm={LOUDNORM_TARGET}:print_format=json,anullsink;"
+                 f"[comp]{MASTER_FILTER}:print_format=json[out]")
+# Brings every segment of the bumpered track to the same rate and layout before concat
+SEGMENT_FILTER = "aresample=48000,aformat=channel_layouts=stereo"
+
+# Runs and wall time per ffmpeg/ffprobe step, reported when the tool exits
+_METRICS = defaultdict(lambda: [0, 0.0])
+_METRICS_LOCK = threading.Lock()
+
+# Live progress bars, set up by main() for --progress
+_PROGRESS = None
+PROGRESS_RE = re.compile(r"out_time_(?:ms|us)=(\d+)")
+
+@contextlib.contextmanager
+def progress_task(label, total):
+    """Yield a callback that moves a progress bar to a position in seconds, or None."""
+    if _PROGRESS is None or not total:
+        yield None
+        return
+    task = _PROGRESS.add_task(label, total=total)
+    try:
+        yield lambda seconds: _PROGRESS.update(task, completed=min(seconds, total))
+    finally:
+        _PROGRESS.remove_task(task)
+
+def _feed(pipe, data):
+    try:
+        pipe.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        pipe.close()
+
+def _run_with_progress(cmd, input, on_progress):
+    # ffmpeg writes key=value progress blocks to stdout; out_time_* is in microseconds
+    cmd = cmd[:1] + ["-progress", "pipe:1"] + cmd[1:]
+    with tempfile.TemporaryFile() as log:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=log)
+        if input is not None:
+            threading.Thread(target=_feed, args=(proc.stdin, input), daemon=True).start()
+        for line in proc.stdout:
+            match = PROGRESS_RE.match(line.decode(errors="replace"))
+            if match:
+                on_progress(int(match.group(1)) / 1_000_000)
+        proc.wait()
+        log.seek(0)
+        return subprocess.CompletedProcess(cmd, proc.returncode, None, log.read())
+
+def _ff(cmd, step, *, capture=False, input=None, on_progress=None):
+    """Run an ffmpeg/ffprobe command and time it under `step`.
+
+    The tool's log is buffered rather than streamed to the terminal, and only shown if it fails.
+    """
+    start = time.perf_counter()
+    if on_progress is not None:
+        result = _run_with_progress(cmd, input, on_progress)
+    else:
+        result = subprocess.run(cmd, input=input, stderr=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL if input is None else None,
+                                stdout=subprocess.PIPE if capture else subprocess.DEVNULL)
+    with _METRICS_LOCK:
+        _METRICS[step][0] += 1
+        _METRICS[step][1] += time.perf_counter() - start
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr.decode(errors="replace"))
+        raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+    return result
+
+def print_metrics():
+    if _METRICS:
+        print("ffmpeg time by step:")
+    for step, (runs, seconds) in sorted(_METRICS.items(), key=lambda item: -item[1][1]):
+        print(f"  {step}: {runs} run(s), {seconds:.2f}s")
+
+def ffmpeg_cmd(*args, loglevel="error"):
+    # -nostdin keeps ffmpeg from polling the terminal for keys; pipe:0 inputs still work.
+    # Mastering and analysis run as -filter_complex graphs, which take their own thread count
+    return [FFMPEG_BIN, "-y", "-nostdin", "-hide_banner", "-nostats", "-loglevel", loglevel,
+            "-filter_threads", FFMPEG_THREADS, "-filter_complex_threads", FFMPEG_THREADS, *args]
+
 def generate_silence(path, dry_run=False):
-    cmd = [
-        "ffmpeg", "-y",
+    cmd = ffmpeg_cmd(
         "-f", "lavfi", "-i", "anullsrc=r=48000:cl=stereo",
         "-t", "1",
-        "-acodec", "libmp3lame", "-b:a", "192k",
+        "-acodec", "libmp3lame", "-b:a", "192k", "-threads", FFMPEG_THREADS,
         path
-    ]
+    )
     if dry_run:
-        print("Dry run:", " ".join(cmd))
+        print("Dry run:", shlex.join(cmd))
     else:
-        subprocess.run(cmd, check=True)
+        _ff(cmd, "silence")
 
-def ensure_stereo_cbr(input_path, output_path, dry_run=False):
+_PROBE_CACHE = None
+_PROBE_LOCK = threading.Lock()
+
+def _probe_cache():
+    """Load the persistent probe cache on first use and arrange for it to be saved at exit."""
+    global _PROBE_CACHE
+    with _PROBE_LOCK:
+        if _PROBE_CACHE is None:
+            try:
+                with open(PROBE_CACHE_PATH) as f:
+                    _PROBE_CACHE = json.load(f)
+            except (OSError, ValueError):
+                _PROBE_CACHE = {}
+            atexit.register(_save_probe_cache, len(_PROBE_CACHE))
+        return _PROBE_CACHE
+
+def _save_probe_cache(loaded):
+    with _PROBE_LOCK:
+        if len(_PROBE_CACHE) == loaded:
+            return
+        # Entries are kept in insertion order, so the oldest probes are the ones dropped
+        entries = dict(list(_PROBE_CACHE.items())[-PROBE_CACHE_MAX:])
+    try:
+        os.makedirs(USER_CACHE_DIR, exist_ok=True)
+        part = f"{PROBE_CACHE_PATH}.{os.getpid()}.part"
+        with open(part, "w") as f:
+            json.dump(entries, f)
+        os.replace(part, PROBE_CACHE_PATH)
+    except OSError:
+        pass
+
+def probe_audio(path):
+    """Return codec, sample rate, channels, bit rate and duration of the first audio stream, or None."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _probe_audio(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+@functools.lru_cache(maxsize=4096)
+def _probe_audio(path, size, mtime_ns):
+    key = f"{path}:{size}:{mtime_ns}"
+    cache = _probe_cache()
+    if key in cache:
+        return cache[key]
     cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-ar", "48000", "-ac", "2", "-b:a", "192k",
-        output_path
+        FFPROBE_BIN, "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name,sample_rate,channels,bit_rate:format=duration",
+        "-of", "json", path
     ]
+    try:
+        info = json.loads(_ff(cmd, "probe", capture=True).stdout)
+        stream = info["streams"][0]
+        result = {
+            "codec": stream["codec_name"],
+            "sample_rate": int(stream["sample_rate"]),
+            "channels": int(stream["channels"]),
+            "bit_rate": int(stream.get("bit_rate", 0)),
+            "duration": float(info.get("format", {}).get("duration", 0)),
+        }
+    except (subprocess.CalledProcessError, ValueError, KeyError, IndexError):
+        return None
+    with _PROBE_LOCK:
+        cache[key] = result
+    return result
+
+def duration_of(path):
+    info = probe_audio(path)
+    return info["duration"] if info else 0.0
+
+def is_stereo_cbr(info):
+    # Allow a little slack for how ffprobe rounds the bit rate
+    return (info is not None and info["codec"] == "mp3" and info["sample_rate"] == 48000
+            and info["channels"] == 2 and abs(info["bit_rate"] - 192000) <= 2000)
+
+# How ensure_stereo_cbr writes the assets; part of their cache key, so changes re-encode them.
+# They are only ever concatenated with -c copy, so skip the Xing/LAME frame and ID3 tag.
+ASSET_ENCODE = ("-ar", "48000", "-ac", "2", "-b:a", "192k")
+ASSET_HEADERS = ("-write_xing", "0", "-id3v2_version", "0", "-map_metadata", "-1")
+
+def ensure_stereo_cbr(input_path, output_path, dry_run=False):
+    if not dry_run and is_stereo_cbr(probe_audio(input_path)):
+        # Already in the delivery format, so just remux the audio stream
+        cmd = ffmpeg_cmd("-i", input_path, "-map", "0:a:0", "-c:a", "copy", *ASSET_HEADERS,
+                         output_path)
+    else:
+        cmd = ffmpeg_cmd(
+            "-i", input_path, *ASSET_ENCODE, "-threads", FFMPEG_THREADS,
+            *ASSET_HEADERS, output_path
+        )
     if dry_run:
-        print("Dry run:", " ".join(cmd))
+        print("Dry run:", shlex.join(cmd))
     else:
-        subprocess.run(cmd, check=True)
+        _ff(cmd, "asset")
+
+@functools.lru_cache(maxsize=None)
+def _normalized_asset(src_path, mtime_ns, dry_run=False):
+    settings = f"{ASSET_ENCODE}:{ASSET_HEADERS}"
+    key = hashlib.sha1(f"{os.path.abspath(src_path)}:{mtime_ns}:{settings}".encode()).hexdigest()
+    cached = os.path.join(CACHE_DIR, key + ".mp3")
+    if os.path.exists(cached):
+        return cached
+    if dry_run:
+        ensure_stereo_cbr(src_path, cached, dry_run=True)
+        return cached
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    part = os.path.join(CACHE_DIR, f"{key}.{os.getpid()}.part.mp3")
+    ensure_stereo_cbr(src_path, part)
+    os.replace(part, cached)
+    return cached
+
+def normalized_asset(src_path, dry_run=False):
+    """Return a stereo CBR copy of an asset, re-encoding it only when the source changes."""
+    mtime_ns = os.stat(src_path).st_mtime_ns if os.path.exists(src_path) else 0
+    with _ASSET_LOCK:
+        return _normalized_asset(src_path, mtime_ns, dry_run)
+
+def measure_loudness(input_file, dry_run=False):
+    """Measure the input as-is and after the compressor in one analysis pass, cached per input file.
+
+    Returns a (raw, compressed) pair of loudnorm stats, or (None, None) on a dry run.
+    """
+    # Keyed on content rather than path, so renamed or moved files still hit the cache
+    st = os.stat(input_file)
+    with open(input_file, "rb") as f:
+        head = hashlib.sha1(f.read(1 << 20)).hexdigest()
+    key = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}:{head}:{MEASURE_GRAPH}".encode()).hexdigest()
+    cached = os.path.join(LOUDNORM_CACHE_DIR, key + ".json")
+    try:
+        with open(cached) as f:
+            stats = json.load(f)
+        os.utime(cached)
+        return stats["raw"], stats["compressed"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # loudnorm reports its stats at info level
+    cmd = ffmpeg_cmd(
+        "-i", input_file,
+        "-filter_complex", MEASURE_GRAPH, "-map", "[out]",
+        "-f", "null", "-",
+        loglevel="info"
+    )
+    if dry_run:
+        print("Dry run:", shlex.join(cmd))
+        return None, None
+    total = duration_of(input_file) if _PROGRESS else 0
+    with progress_task(f"Analysing {os.path.basename(input_file)}", total) as on_progress:
+        log = _ff(cmd, "measure", on_progress=on_progress).stderr.decode(errors="replace")
+    # Each loudnorm prints its stats on stderr, tagged with its position in the graph
+    blocks = re.findall(r"\[Parsed_loudnorm_(\d+) @ [^\]]*\]\s*(\{[^{}]*\})", log)
+    raw, compressed = [json.loads(block) for _, block in sorted(blocks, key=lambda b: int(b[0]))]
+    os.makedirs(LOUDNORM_CACHE_DIR, exist_ok=True)
+    part = f"{cached}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(part, "w") as f:
+        json.dump({"raw": raw, "compressed": compressed}, f)
+    os.replace(part, cached)
+    _prune_cache(LOUDNORM_CACHE_DIR, LOUDNORM_CACHE_MAX)
+    return raw, compressed
+
+def _prune_cache(directory, keep):
+    """Delete the least recently used entries once a cache directory holds more than `keep`."""
+    with os.scandir(directory) as it:
+        entries = [entry for entry in it if entry.name.endswith(".json")]
+    if len(entries) <= keep:
+        return
+
+    def last_used(entry):
+        # Another worker pruning at the same time may already have removed it
+        try:
+            return entry.stat().st_mtime
+        except OSError:
+            return 0
+
+    entries.sort(key=last_used)
+    for entry in entries[:len(entries) - keep]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def needs_mastering(raw):
+    """False when the untouched input already meets the loudness profile."""
+    return (abs(float(raw["input_i"]) - PROFILE["LUFS"]) > 0.5
+            or float(raw["input_tp"]) > PROFILE["TP"] + 0.1
+            or float(raw["input_lra"]) > PROFILE["LRA"])
+
+def already_mastered(input_file, dry_run=False):
+    """True for MP3 input that is already in the delivery format and at target loudness."""
+    if not input_file.lower().endswith(".mp3"):
+        return False
+    if not is_stereo_cbr(probe_audio(input_file)):
+        return False
+    # A dry run can still decide from a cached measurement; otherwise it can only say so
+    raw, _ = measure_loudness(input_file, dry_run=dry_run)
+    if raw is None:
+        print(f"Dry run: {input_file} is already 192k CBR; it is stream-copied instead of "
+              "re-mastered if the measurement above is on target")
+        return False
+    return not needs_mastering(raw)
+
+def master_filter(stats=None):
+    """Return the mastering chain, in linear mode when first-pass stats are available."""
+    if stats is None:
+        return MASTER_FILTER
+    measured = [stats["input_i"], stats["input_tp"], stats["input_lra"], stats["input_thresh"],
+                stats["target_offset"]]
+    if not all(math.isfinite(float(value)) for value in measured):
+        # Silent or near-silent input; let loudnorm fall back to dynamic mode
+        return MASTER_FILTER
+    return (f"{MASTER_FILTER}:measured_I={stats['input_i']}:measured_TP={stats['input_tp']}"
+            f":measured_LRA={stats['input_lra']}:measured_thresh={stats['input_thresh']}"
+            f":offset={stats['target_offset']}:linear=true")
 
 def validate_args(args):
     if args.skip_bumper and (args.custom_head or args.custom_tail or args.no_head or args.no_tail):
@@ -45,105 +405,450 @@ def validate_args(args):
         sys.exit("Error: --no-head cannot be used with --custom-head")
     if args.no_tail and args.custom_tail:
         sys.exit("Error: --no-tail cannot be used with --custom-tail")
+    if args.in_process and args.add_bumper:
+        sys.exit("Error: --in-process cannot be used with --add-bumper")
+    if args.in_process and np is None:
+        sys.exit("Error: --in-process needs numpy, scipy, soundfile and pyloudnorm installed")
+    # process_file re-validates its own options, which don't include --jobs
+    if getattr(args, "jobs", None) is not None and args.jobs < 1:
+        sys.exit("Error: --jobs must be at least 1")
 
-def process_file(input_file, output_file, add_bumper=False, skip_bumper=False, dry_run=False,
-                 custom_head=None, custom_tail=None, no_head=False, no_tail=False):
-    validate_args(argparse.Namespace(
-        skip_bumper=skip_bumper, custom_head=custom_head,
-        custom_tail=custom_tail, no_head=no_head, no_tail=no_tail
-    ))
+def prepare_silence(dry_run=False):
+    if not os.path.exists(SILENCE_PATH):
+        print("Silence file not found, generating...")
+        os.makedirs(os.path.dirname(SILENCE_PATH), exist_ok=True)
+        generate_silence(SILENCE_PATH, dry_run=dry_run)
 
-    temp_mastered = tempfile.mktemp(suffix=".mp3")
-    if not add_bumper:
-        cmd = [
-            "ffmpeg", "-y", "-i", input_file,
-            "-af", f"acompressor=threshold=-18dB:ratio=3:attack=10:release=200,"
-                   f"loudnorm=I={PROFILE['LUFS']}:LRA={PROFILE['LRA']}:TP={PROFILE['TP']}",
-            "-c:a", "libmp3lame", "-b:a", "192k", "-ar", "48000", "-ac", "2",
-            temp_mastered
-        ]
-        if dry_run:
-            print("Dry run:", " ".join(cmd))
-        else:
-            subprocess.run(cmd, check=True)
-    else:
-        temp_mastered = input_file
+def bumper_layout(custom_head=None, custom_tail=None, no_head=False, no_tail=False):
+    """Return the segment paths of a bumpered track, with None standing in for the main content."""
+    segments = []
+    if not no_head:
+        head_path = custom_head or DEFAULT_HEAD
+        if not os.path.exists(head_path):
+            sys.exit(f"Missing head bumper: {head_path}")
+        segments.append(head_path)
+    segments.append(None)
+    if not no_tail:
+        tail_path = custom_tail or DEFAULT_TAIL
+        if not os.path.exists(tail_path):
+            sys.exit(f"Missing tail bumper: {tail_path}")
+        segments += [SILENCE_PATH, tail_path, SILENCE_PATH]
+    return segments
 
-    if skip_bumper:
+def _compress(data, rate, block=32):
+    """Downward compressor modelled on ffmpeg's acompressor with COMPRESSOR_FILTER's settings.
+
+    Like acompressor, the detector is the channel-averaged level in RMS mode, rising with the
+    attack coefficient and falling with the release one (hard knee here). The detector runs on
+    short blocks so the loop stays cheap, and the gain is interpolated back between them.
+    """
+    threshold, ratio = 10 ** (-18 / 20), 3
+    attack = 1 - (1 - min(1.0, 4000 / (10 * rate))) ** block
+    release = 1 - (1 - min(1.0, 4000 / (200 * rate))) ** block
+    power = np.abs(data).mean(axis=1, dtype=np.float64) ** 2
+    blocks = -(-len(power) // block)
+    power = np.pad(power, (0, blocks * block - len(power))).reshape(blocks, block).mean(axis=1)
+    level = 0.0
+    detector = np.empty(blocks)
+    for i, sample in enumerate(power.tolist()):
+        level += (sample - level) * (attack if sample > level else release)
+        detector[i] = level
+    # Detector values are power, hence the extra square root; silence sits below the threshold
+    gain = (np.maximum(detector, threshold ** 2) / threshold ** 2) ** ((1 / ratio - 1) / 2)
+    centres = np.arange(blocks) * block + (block - 1) / 2
+    return data * np.interp(np.arange(len(data)), centres, gain).astype(np.float32)[:, None]
+
+def _true_peaks(data):
+    """Per-sample true peak: the loudest of the four oversampled points each sample spans."""
+    oversampled = np.abs(resample_poly(data, 4, 1, axis=0))
+    return oversampled.reshape(len(data), 4 * data.shape[1]).max(axis=1)
+
+def _limit(data, ceiling, rate):
+    """Pull true peaks above `ceiling` down with a smooth 5 ms look-ahead gain curve."""
+    needed = np.minimum(1.0, ceiling / np.maximum(_true_peaks(data), 1e-9))
+    if needed.min() >= 1.0:
+        return data
+    width = max(1, int(0.005 * rate))
+    # Averaging over half the span of the window minimum never rises above any sample's need
+    gain = uniform_filter1d(minimum_filter1d(needed, 2 * width + 1), width + 1, mode="nearest")
+    return data * gain.astype(np.float32)[:, None]
+
+def master_in_process(input_file):
+    """Compress and loudness-normalise a mono or stereo file with numpy instead of ffmpeg's filters.
+
+    Returns stereo float32 samples and their sample rate. The whole file is held in memory.
+    """
+    data, rate = soundfile.read(input_file, dtype="float32", always_2d=True)
+    if data.shape[1] > 2:
+        raise ValueError(f"--in-process handles mono and stereo only, not {data.shape[1]} channels")
+    data = np.repeat(data, 2, axis=1) if data.shape[1] == 1 else data
+    if not data.size:
+        return data, rate
+    data = _compress(data, rate)
+    ceiling = 10 ** (PROFILE["TP"] / 20)
+    meter = pyloudnorm.Meter(rate)
+    if len(data) < meter.block_size * rate:
+        # Too short for a single loudness block, so there is nothing to normalise against
+        return np.ascontiguousarray(_limit(data, ceiling, rate), dtype=np.float32), rate
+
+    # Limiting the peaks lowers the loudness a little, so gain and limit until both targets hold
+    for _ in range(5):
+        loudness = meter.integrated_loudness(data)
+        if not math.isfinite(loudness):
+            break
+        if abs(loudness - PROFILE["LUFS"]) <= 0.1 and _true_peaks(data).max() <= ceiling:
+            break
+        data = _limit(data * np.float32(10 ** ((PROFILE["LUFS"] - loudness) / 20)), ceiling, rate)
+    return np.ascontiguousarray(data, dtype=np.float32), rate
+
+def render_master(input_file, output_file, segments, dry_run=False, in_process=False):
+    # One ffmpeg run: master the content and concat it with any bumpers in a single filter graph,
+    # encoding straight to the output with no intermediate file
+    samples = None
+    if in_process:
+        # The content arrives already mastered as raw float samples on stdin
+        rate = 48000
         if not dry_run:
-            os.rename(temp_mastered, output_file)
+            samples, rate = master_in_process(input_file)
+        content = ["-f", "f32le", "-ar", str(rate), "-ac", "2", "-i", "pipe:0"]
+        mastering = "anull"
+    else:
+        content = ["-i", input_file]
+        raw, compressed = measure_loudness(input_file, dry_run=dry_run)
+        if raw is not None and not needs_mastering(raw):
+            # Already at target loudness; only convert to the delivery format
+            mastering = "anull"
+        else:
+            mastering = master_filter(compressed)
+    cmd = ffmpeg_cmd()
+    filters, labels = [], []
+    for i, path in enumerate(segments):
+        chain = SEGMENT_FILTER
+        if path is None:
+            cmd += content
+            chain = f"{mastering},{SEGMENT_FILTER}"
+        elif path == SILENCE_PATH:
+            # Generate the gaps in the graph rather than decoding an MP3 of silence
+            cmd += ["-f", "lavfi", "-t", "1", "-i", "anullsrc=r=48000:cl=stereo"]
         else:
-            print(f"Dry run: would rename {temp_mastered} to {output_file}")
+            source = LOSSLESS_ASSETS.get(path)
+            cmd += ["-i", source if source and os.path.exists(source) else path]
+        filters.append(f"[{i}:a]{chain}[s{i}]")
+        labels.append(f"[s{i}]")
+    if len(labels) > 1:
+        filters.append("".join(labels) + f"concat=n={len(labels)}:v=0:a=1[out]")
+        out_label = "[out]"
+    else:
+        out_label = labels[0]
+    cmd += [
+        "-filter_complex", ";".join(filters), "-map", out_label,
+        "-c:a", "libmp3lame", "-b:a", "192k", "-ar", "48000", "-ac", "2", "-threads", FFMPEG_THREADS,
+        output_file
+    ]
+    if dry_run:
+        print("Dry run:", shlex.join(cmd))
         return
+    total = 0
+    if _PROGRESS:
+        total = len(samples) / rate if samples is not None else duration_of(input_file)
+        total += sum(1 if path == SILENCE_PATH else duration_of(path) for path in segments if path)
+    with progress_task(f"Mastering {os.path.basename(input_file)}", total) as on_progress:
+        if samples is not None:
+            _ff(cmd, "master", input=memoryview(samples).cast("B"), on_progress=on_progress)
+        else:
+            _ff(cmd, "master", on_progress=on_progress)
 
-    # Prepare assets
-    if not os.path.exists(SILENCE_PATH):
-        print("Silence file not found, generating...")
-        os.makedirs(os.path.dirname(SILENCE_PATH), exist_ok=True)
-        generate_silence(SILENCE_PATH, dry_run=dry_run)
+def add_bumpers(input_file, output_file, segments, dry_run=False):
+    # The input is already mastered, so concat it with the cached assets using -c copy
+    listing = ""
+    for path in segments:
+        if path is None:
+            path = os.path.abspath(input_file)
+        else:
+            path = normalized_asset(path, dry_run=dry_run)
+        # Entries are resolved against the list's URL, so name the protocol explicitly
+        escaped = path.replace("'", "'\\''")
+        listing += f"file 'file:{escaped}'\n"
 
-    silence_fixed = tempfile.mktemp(suffix=".mp3")
-    ensure_stereo_cbr(SILENCE_PATH, silence_fixed, dry_run=dry_run)
-
-    concat_list = tempfile.mktemp(suffix=".txt")
-
-    with open(concat_list, "w") as f:
-        if not no_head:
-            head_path = custom_head or DEFAULT_HEAD
-            if not os.path.exists(head_path):
-                sys.exit(f"Missing head bumper: {head_path}")
-            head_fixed = tempfile.mktemp(suffix=".mp3")
-            ensure_stereo_cbr(head_path, head_fixed, dry_run=dry_run)
-            f.write(f"file '{head_fixed}'\n")
-        f.write(f"file '{temp_mastered}'\n")
-        if not no_tail:
-            tail_path = custom_tail or DEFAULT_TAIL
-            if not os.path.exists(tail_path):
-                sys.exit(f"Missing tail bumper: {tail_path}")
-            tail_fixed = tempfile.mktemp(suffix=".mp3")
-            ensure_stereo_cbr(tail_path, tail_fixed, dry_run=dry_run)
-            f.write(f"file '{silence_fixed}'\n")
-            f.write(f"file '{tail_fixed}'\n")
-            f.write(f"file '{silence_fixed}'\n")
-
-    cmd_concat = [
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list,
-        "-c", "copy", output_file
-    ]
+    # The list goes in over stdin, so no temp file is written
+    cmd_concat = ffmpeg_cmd(
+        "-f", "concat", "-safe", "0", "-protocol_whitelist", "pipe,file",
+        "-i", "pipe:0", "-c", "copy", output_file
+    )
     if dry_run:
-        print("Dry run:", " ".join(cmd_concat))
+        print("Dry run:", shlex.join(cmd_concat))
+        print(listing, end="")
     else:
-        subprocess.run(cmd_concat, check=True)
+        _ff(cmd_concat, "concat", input=listing.encode())
 
-    for path in [concat_list, silence_fixed]:
-        if os.path.exists(path) and not dry_run:
-            os.remove(path)
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-    if not add_bumper and temp_mastered != input_file and os.path.exists(temp_mastered):
-        if dry_run:
-            print(f"Dry run: would remove {temp_mastered}")
+def _link_is_current(source, target, input_path):
+    """True while a duplicate's output still matches its original's output and its own input."""
+    if not os.path.exists(source):
+        return True
+    try:
+        if os.path.samefile(source, target):
+            return True
+        # Rebuilt outputs are swapped in as new files, leaving an older link on the old inode
+        return os.path.getmtime(target) >= max(os.path.getmtime(source), os.path.getmtime(input_path))
+    except OSError:
+        return False
+
+def _cache_key(paths, settings):
+    """Hash the size and mtime of every source file plus the settings that shape the output."""
+    digest = hashlib.sha256(repr(settings).encode())
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
         else:
-            os.remove(temp_mastered)
+            digest.update(f"{os.path.abspath(path)}:missing\n".encode())
+    return digest.hexdigest()
+
+def _stored_cache_key(output_file):
+    try:
+        with open(output_file + CACHEKEY_SUFFIX) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def process_file(input_file, output_file, add_bumper=False, skip_bumper=False, dry_run=False,
+                 custom_head=None, custom_tail=None, no_head=False, no_tail=False, force=False,
+                 in_process=False):
+    validate_args(argparse.Namespace(
+        skip_bumper=skip_bumper, custom_head=custom_head,
+        custom_tail=custom_tail, no_head=no_head, no_tail=no_tail,
+        add_bumper=add_bumper, in_process=in_process
+    ))
+
+    if skip_bumper:
+        segments = [None]
+    else:
+        segments = bumper_layout(custom_head, custom_tail, no_head, no_tail)
+
+    # MP3s that already meet the spec get the same stream-copy treatment as --add-bumper
+    copy_only = add_bumper or already_mastered(input_file, dry_run=dry_run)
+    if copy_only and not skip_bumper:
+        # Created before hashing, so the first run doesn't record it as missing
+        prepare_silence(dry_run=dry_run)
 
+    # Mastering generates its gaps in the graph, so only the copy path reads SILENCE_PATH
+    sources = [input_file] + [path for path in segments
+                              if path is not None and (copy_only or path != SILENCE_PATH)]
+    sources += [LOSSLESS_ASSETS[path] for path in segments if path in LOSSLESS_ASSETS]
+    key = _cache_key(sources, (MASTER_FILTER, add_bumper, skip_bumper, in_process, copy_only,
+                               segments))
+    if not force and os.path.exists(output_file) and _stored_cache_key(output_file) == key:
+        print("Up to date:", output_file)
+        return
+
+    if add_bumper and skip_bumper:
+        # This moves the user's own file, so it goes straight to its new name: a part file
+        # cleaned up on failure would take the only copy of the input with it
+        if dry_run:
+            print(f"Dry run: would rename {input_file} to {output_file}")
+            return
+        os.rename(input_file, output_file)
+    else:
+        # Written next to the output and renamed into place, so an interrupted run never
+        # leaves a truncated file behind under the real name
+        part = output_file if dry_run else f"{output_file}.part-{os.getpid()}-{threading.get_ident()}.mp3"
+        try:
+            if not copy_only:
+                render_master(input_file, part, segments, dry_run=dry_run, in_process=in_process)
+            elif skip_bumper:
+                if dry_run:
+                    print(f"Dry run: would link {output_file} to {input_file} (already mastered)")
+                else:
+                    _link_or_copy(input_file, part)
+            else:
+                add_bumpers(input_file, part, segments, dry_run=dry_run)
+            if not dry_run:
+                os.replace(part, output_file)
+        finally:
+            if not dry_run and os.path.exists(part):
+                os.remove(part)
+
+    if not dry_run:
+        with open(output_file + CACHEKEY_SUFFIX, "w") as f:
+            f.write(key + "\n")
     print("Mastering complete:", output_file)
 
-def run_batch(in_dir, out_dir, add_bumper=False, skip_bumper=False, force=False, dry_run=False,
-              custom_head=None, custom_tail=None, no_head=False, no_tail=False):
-    for filename in os.listdir(in_dir):
-        input_path = os.path.join(in_dir, filename)
-        if not os.path.isfile(input_path):
+def _quickhash(path, size):
+    """Cheap fingerprint from the size and the first and last 64 KiB of a file."""
+    with open(path, "rb") as f:
+        head = f.read(65536)
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+    return hashlib.blake2b(head + tail + str(size).encode(), digest_size=16).hexdigest()
+
+def _file_digest(path):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def find_duplicates(entries):
+    """Split directory entries into unique files and (original, duplicate) byte-identical pairs."""
+    candidates = defaultdict(list)
+    for entry in entries:
+        ext = os.path.splitext(entry.name)[1].lower()
+        candidates[ext, _quickhash(entry.path, entry.stat().st_size)].append(entry)
+    unique, duplicates = [], []
+    for group in candidates.values():
+        if len(group) == 1:
+            unique.append(group[0])
             continue
-        name, ext = os.path.splitext(filename)
-        if ext.lower() not in [".wav", ".mp3"]:
+        # The quick hash only narrows things down; confirm on the full contents
+        identical = defaultdict(list)
+        for entry in group:
+            identical[_file_digest(entry.path)].append(entry)
+        for same in identical.values():
+            unique.append(same[0])
+            duplicates += [(same[0], entry) for entry in same[1:]]
+    return unique, duplicates
+
+def _prewarm(paths):
+    """Ask the kernel to start reading files into the page cache before the workers need them."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
             continue
-        output_path = os.path.join(out_dir, name + ".mp3")
-        if os.path.exists(output_path) and not force:
-            print("Skipping existing file:", output_path)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+def _worker(task):
+    input_path, output_path, force, options = task
+    # Outputs with a cache key are checked against their sources in process_file; older
+    # outputs without one are kept unless the input has been modified since
+    if (not force and os.path.exists(output_path)
+            and not os.path.exists(output_path + CACHEKEY_SUFFIX)
+            and os.path.getmtime(output_path) >= os.path.getmtime(input_path)):
+        print("Skipping existing file:", output_path)
+        return
+    print("Processing:", input_path)
+    process_file(input_path, output_path, force=force, **options)
+
+def run_batch(in_dir, out_dir, add_bumper=False, skip_bumper=False, force=False, dry_run=False,
+              custom_head=None, custom_tail=None, no_head=False, no_tail=False, in_process=False,
+              jobs=None):
+    global FFMPEG_THREADS
+    options = dict(add_bumper=add_bumper, skip_bumper=skip_bumper, dry_run=dry_run,
+                   custom_head=custom_head, custom_tail=custom_tail,
+                   no_head=no_head, no_tail=no_tail, in_process=in_process)
+    # scandir hands back cached type and stat info, saving a syscall or two per entry
+    with os.scandir(in_dir) as it:
+        entries = [entry for entry in it
+                   if entry.name.lower().endswith(SUPPORTED_EXTS) and entry.is_file()]
+    encode_jobs = jobs or ENCODE_JOBS
+    copy_jobs = jobs or COPY_JOBS
+
+    # Probe everything up front, so a bad file is reported now rather than hours into the batch
+    def readable(entry):
+        return entry.stat().st_size > 0 and probe_audio(entry.path) is not None
+
+    with ThreadPoolExecutor(max_workers=copy_jobs) as pool:
+        checks = list(pool.map(readable, entries))
+    failed = set()
+    for entry, ok in zip(entries, checks):
+        if not ok:
+            print(f"Failed: {entry.path} (no readable audio stream)", file=sys.stderr)
+            failed.add(entry.path)
+    entries = [entry for entry, ok in zip(entries, checks) if ok]
+
+    def output_for(entry):
+        return os.path.join(out_dir, os.path.splitext(entry.name)[0] + ".mp3")
+
+    # Mastering prefers the lossless .wav; --add-bumper stream-copies, so it needs the .mp3
+    preferred = (".mp3", ".wav") if add_bumper else (".wav", ".mp3")
+
+    def source_rank(entry):
+        stem, ext = os.path.splitext(entry.name)
+        return stem, preferred.index(ext.lower())
+
+    # song.wav and song.mp3 both map to song.mp3; keep only the preferred one so two workers
+    # never race on the same output
+    claimed = set()
+    unique = []
+    for entry in sorted(entries, key=source_rank):
+        target = output_for(entry)
+        if target in claimed:
+            print(f"Skipping {entry.path}: another input already writes {target}", file=sys.stderr)
             continue
-        print("Processing:", input_path)
-        process_file(input_path, output_path, add_bumper=add_bumper, skip_bumper=skip_bumper,
-                     dry_run=dry_run, custom_head=custom_head, custom_tail=custom_tail,
-                     no_head=no_head, no_tail=no_tail)
+        claimed.add(target)
+        unique.append(entry)
+    # Byte-identical inputs are processed once and their outputs linked afterwards
+    entries, duplicates = find_duplicates(unique)
+    # Largest first, so a long file is never started last while the other workers sit idle
+    entries.sort(key=lambda entry: entry.stat().st_size, reverse=True)
+
+    encode_tasks, copy_tasks = [], []
+    for entry in entries:
+        input_path = entry.path
+        ext = os.path.splitext(entry.name)[1]
+        task = (input_path, output_for(entry), force, options)
+        if add_bumper and ext.lower() == ".mp3":
+            copy_tasks.append(task)
+        else:
+            encode_tasks.append(task)
+
+    if encode_jobs > 1:
+        FFMPEG_THREADS = str(max(1, CPU_COUNT // encode_jobs))
+
+    if not dry_run:
+        # Every job reads the bumpers, and the first wave of inputs is needed right away
+        assets = [custom_head or DEFAULT_HEAD, custom_tail or DEFAULT_TAIL, SILENCE_PATH,
+                  DEFAULT_HEAD_SRC, DEFAULT_TAIL_SRC]
+        first_wave = encode_tasks[:encode_jobs * 2] + copy_tasks[:copy_jobs * 2]
+        _prewarm(assets + [task[0] for task in first_wave])
+
+    with ThreadPoolExecutor(max_workers=encode_jobs) as encode_pool, \
+            ThreadPoolExecutor(max_workers=copy_jobs) as copy_pool:
+        futures = [encode_pool.submit(_worker, task) for task in encode_tasks]
+        futures += [copy_pool.submit(_worker, task) for task in copy_tasks]
+        # One bad file shouldn't hide the others: report each failure and carry on
+        for future, task in zip(futures, encode_tasks + copy_tasks):
+            try:
+                future.result()
+            except KeyboardInterrupt:
+                # Leaving the with block would otherwise start every queued job before exiting
+                encode_pool.shutdown(wait=False, cancel_futures=True)
+                copy_pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            except Exception as e:
+                if isinstance(e, subprocess.CalledProcessError):
+                    e = f"{os.path.basename(e.cmd[0])} exited with status {e.returncode}"
+                print(f"Failed: {task[0]} ({e})", file=sys.stderr)
+                failed.add(task[0])
+
+    for original, duplicate in duplicates:
+        source, target = output_for(original), output_for(duplicate)
+        if original.path in failed:
+            print(f"Failed: {duplicate.path} (identical to {original.path})", file=sys.stderr)
+            failed.add(duplicate.path)
+        elif os.path.exists(target) and not force and _link_is_current(source, target, duplicate.path):
+            print("Skipping existing file:", target)
+        elif dry_run:
+            print(f"Dry run: would link {target} to {source} (identical input)")
+        elif os.path.exists(source):
+            _link_or_copy(source, target)
+            print("Linked identical input:", target)
+
+    if failed:
+        sys.exit(f"{len(failed)} file(s) failed")
 
 def main():
     parser = argparse.ArgumentParser(description="AudioVault Mastering Tool")
@@ -158,32 +863,49 @@ def main():
     parser.add_argument("--batch", action="store_true", help="Batch mode (input/output folders)")
     parser.add_argument("--force", action="store_true", help="Force overwrite")
     parser.add_argument("--dry-run", action="store_true", help="Print what would be done without executing")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Master with numpy/pyloudnorm instead of ffmpeg filters (loads each file into memory)")
+    parser.add_argument("--progress", action="store_true", help="Show progress bars (needs the rich package)")
+    parser.add_argument("--jobs", type=int, help="Parallel files in batch mode (default: CPUs/4 when mastering, up to 16 with --add-bumper)")
 
     args = parser.parse_args()
     validate_args(args)
 
-    if args.batch:
-        in_dir = args.input or "./in"
-        out_dir = args.output or "./out"
-        if not os.path.isdir(in_dir):
-            sys.exit(f"Missing input folder: {in_dir}")
-        if not os.path.isdir(out_dir):
-            if args.dry_run:
-                print(f"Dry run: would create folder {out_dir}")
+    global _PROGRESS
+    if args.progress:
+        if Progress is None:
+            sys.exit("Error: --progress needs the rich package installed")
+        _PROGRESS = Progress()
+
+    # In a finally so batches that exit with failures still report their timings
+    try:
+        with _PROGRESS or contextlib.nullcontext():
+            if args.batch:
+                in_dir = args.input or "./in"
+                out_dir = args.output or "./out"
+                if not os.path.isdir(in_dir):
+                    sys.exit(f"Missing input folder: {in_dir}")
+                if not os.path.isdir(out_dir):
+                    if args.dry_run:
+                        print(f"Dry run: would create folder {out_dir}")
+                    else:
+                        os.makedirs(out_dir)
+                run_batch(in_dir, out_dir, add_bumper=args.add_bumper, skip_bumper=args.skip_bumper,
+                          force=args.force, dry_run=args.dry_run, custom_head=args.custom_head,
+                          custom_tail=args.custom_tail, no_head=args.no_head, no_tail=args.no_tail,
+                          in_process=args.in_process, jobs=args.jobs)
             else:
-                os.makedirs(out_dir)
-        run_batch(in_dir, out_dir, add_bumper=args.add_bumper, skip_bumper=args.skip_bumper,
-                  force=args.force, dry_run=args.dry_run, custom_head=args.custom_head,
-                  custom_tail=args.custom_tail, no_head=args.no_head, no_tail=args.no_tail)
-    else:
-        if not args.input or not args.output:
-            sys.exit("In single mode, both input and output files must be specified.")
-        if not os.path.isfile(args.input):
-            sys.exit("Invalid input file.")
-        process_file(args.input, args.output, add_bumper=args.add_bumper,
-                     skip_bumper=args.skip_bumper, dry_run=args.dry_run,
-                     custom_head=args.custom_head, custom_tail=args.custom_tail,
-                     no_head=args.no_head, no_tail=args.no_tail)
+                if not args.input or not args.output:
+                    sys.exit("In single mode, both input and output files must be specified.")
+                if not os.path.isfile(args.input):
+                    sys.exit("Invalid input file.")
+                process_file(args.input, args.output, add_bumper=args.add_bumper,
+                             skip_bumper=args.skip_bumper, dry_run=args.dry_run,
+                             custom_head=args.custom_head, custom_tail=args.custom_tail,
+                             no_head=args.no_head, no_tail=args.no_tail, force=args.force,
+                             in_process=args.in_process)
+    finally:
+        print_metrics()
 
 if __name__ == "__main__":
     main()